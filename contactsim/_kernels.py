@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+#  Copyright 2024-2025 ContactSim contributors
+#  SPDX-License-Identifier: Apache-2.0
+#
+
+# This file contains the compiled (Numba) per-tick kernels used by the
+# Simulation class. Numba is optional - if it is not installed the
+# Simulation falls back to an equivalent NumPy implementation.
+
+from functools import lru_cache
+import math
+import numpy as np
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """
+        Stand in for numba.njit when Numba is not installed. Returns the function uncompiled.
+        """
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+    prange = range
+
+# log10(x) == ln(x) * log10(e). Multiplying a natural log by this saves the division within log10
+LOG10_E = 0.43429448190325176
+
+
+@lru_cache(maxsize=None)
+def make_tick_kernel(maxRange, wavelength, friisConst):
+    """
+    Creates a compiled per-tick kernel specialised to a Simulation's fixed radio constants.
+
+    The constants are baked into the kernel as compile time constants (rather than passed on each call) so the
+    compiler can fold them into the inner loop. Kernels are cached, both in memory and on disk, per set of constants.
+
+    Args:
+        maxRange:       float Maximum detection range in metres
+        wavelength:     float Wavelength in metres
+        friisConst:     float 20*log10(wavelength/(4*pi)), so that receiver power is gains + friisConst - 10*log10(distance^2)
+
+    Returns:
+        tickKernel:     function(x, y, powerTx, gainTx, gainRx, cellIds, cellStarts, nCols) The compiled kernel. See _tick_kernel below.
+    """
+    maxRangeSq = np.float32(maxRange * maxRange)
+    wavelengthSq = np.float32(wavelength * wavelength)
+    friisConst = np.float32(friisConst)
+    # Keep all arithmetic in float32 (a float64 literal would promote it). 10*log10(d^2) is calculated as tenLog10E*ln(d^2)
+    tenLog10E = np.float32(10.0 * LOG10_E)
+
+    @njit("Tuple((int64[::1], int64[::1], float32[::1]))(float32[::1], float32[::1], float32[::1], float32[::1], float32[::1], int64[::1], int64[::1], int64)",
+          parallel=True, fastmath=True, cache=True)
+    def _tick_kernel(x, y, powerTx, gainTx, gainRx, cellIds, cellStarts, nCols):
+        """
+        Calculates the receiver power for every ordered (rx,tx) actor pair within range for a single tick.
+
+        Pairs are considered if the actors are at least a wavelength apart (Friis formula restriction) and no more than maxRange apart.
+        Each pair's distance is calculated once, and is heard in both directions - i receiving from j immediately followed by j receiving from i.
+
+        The actor arrays must be sorted by grid cell (See Simulation._sortByCell). Only pairs in neighbouring cells are checked, and
+        as each cell's actors are contiguous in memory they stay in cache while being compared. Only occupied cells are visited, so the
+        cost depends on the number of actors, not the size of the simulation space.
+
+        Args:
+            x:              ndarray float32 x position of each actor in metres
+            y:              ndarray float32 y position of each actor in metres
+            powerTx:        ndarray float32 Transmission Power (TxPower) of each actor in dBm
+            gainTx:         ndarray float32 Transmitter Gain (TxGain) of each actor in dBm
+            gainRx:         ndarray float32 Receiver Gain (RxGain) of each actor in dBm
+            cellIds:        ndarray int64 The (sorted) grid cell number of each occupied cell
+            cellStarts:     ndarray int64 Index of the first actor in each occupied cell, plus a final entry of the actor count
+            nCols:          int The number of columns in the grid
+
+        Returns:
+            rxIdxs:         ndarray int64 Receiver actor index of each reading
+            txIdxs:         ndarray int64 Transmitter actor index of each reading
+            powerRx:        ndarray float32 Calculated Receiver Power in dBm of each reading
+        """
+        n = x.shape[0]
+        nCells = cellIds.shape[0]
+
+        # First pass counts each actor's pairs (with higher index actors) so each thread knows where to write in the second pass
+        # (Measured faster than a single pass into worst case sized per-actor buffers plus a merge, as the worst case - every
+        # neighbouring actor - is several times the number of pairs actually in range, so the extra memory traffic costs more)
+        counts = np.zeros(n, dtype=np.int64)
+        for cell in prange(nCells):
+            sameRowEnd, nextRowStart, nextRowEnd = _neighbourBlocks(cell, cellIds, cellStarts, nCols)
+            for i in range(cellStarts[cell], cellStarts[cell + 1]):
+                count = 0
+                for block in range(2):
+                    start, end = (i + 1, sameRowEnd) if block == 0 else (nextRowStart, nextRowEnd)
+                    for j in range(start, end):
+                        dx = x[i] - x[j]
+                        dy = y[i] - y[j]
+                        distanceSq = dx * dx + dy * dy
+                        if distanceSq <= maxRangeSq and distanceSq >= wavelengthSq:
+                            count += 2
+                counts[i] = count
+        starts = np.zeros(n + 1, dtype=np.int64)
+        starts[1:] = np.cumsum(counts)
+
+        total = starts[n]
+        rxIdxs = np.empty(total, dtype=np.int64)
+        txIdxs = np.empty(total, dtype=np.int64)
+        powerRx = np.empty(total, dtype=np.float32)
+        for cell in prange(nCells):
+            sameRowEnd, nextRowStart, nextRowEnd = _neighbourBlocks(cell, cellIds, cellStarts, nCols)
+            for i in range(cellStarts[cell], cellStarts[cell + 1]):
+                k = starts[i]
+                for block in range(2):
+                    start, end = (i + 1, sameRowEnd) if block == 0 else (nextRowStart, nextRowEnd)
+                    for j in range(start, end):
+                        dx = x[i] - x[j]
+                        dy = y[i] - y[j]
+                        distanceSq = dx * dx + dy * dy
+                        if distanceSq <= maxRangeSq and distanceSq >= wavelengthSq:
+                            pathGain = friisConst - tenLog10E * math.log(distanceSq)
+                            rxIdxs[k] = i
+                            txIdxs[k] = j
+                            powerRx[k] = gainRx[i] + powerTx[j] + gainTx[j] + pathGain # dBm
+                            rxIdxs[k + 1] = j
+                            txIdxs[k + 1] = i
+                            powerRx[k + 1] = gainRx[j] + powerTx[i] + gainTx[i] + pathGain # dBm
+                            k += 2
+        return rxIdxs, txIdxs, powerRx
+
+    return _tick_kernel
+
+
+@njit("UniTuple(int64, 3)(int64, int64[::1], int64[::1], int64)", cache=True)
+def _neighbourBlocks(cell, cellIds, cellStarts, nCols):
+    """
+    Returns the ranges of actor indexes, 'after' those in an occupied cell, that the cell's actors need comparing with. Actors must be sorted by grid cell.
+
+    These are the next cell in the row, then the three neighbouring cells in the next row. Both are all later in the actor arrays
+    (and in increasing order), so each pair of actors in neighbouring cells is found exactly once. The next row's three cells are
+    contiguous in the actor arrays, so are found with a single pair of binary searches of the occupied cells.
+
+    Args:
+        cell:           int The index of the occupied cell (into cellIds)
+        cellIds:        ndarray int64 The (sorted) grid cell number of each occupied cell
+        cellStarts:     ndarray int64 Index of the first actor in each occupied cell, plus a final entry of the actor count
+        nCols:          int The number of columns in the grid
+
+    Returns:
+        sameRowEnd:     int One past the last actor index in this cell or the next cell in the row (actor i compares from i+1 to this)
+        nextRowStart:   int The first actor index in the next row's neighbouring cells
+        nextRowEnd:     int One past the last actor index in the next row's neighbouring cells (equal to nextRowStart if they are empty)
+    """
+    nCells = cellIds.shape[0]
+    cellId = cellIds[cell]
+    col = cellId % nCols
+    sameRowEnd = cellStarts[cell + 1]
+    if col + 1 < nCols and cell + 1 < nCells and cellIds[cell + 1] == cellId + 1:
+        sameRowEnd = cellStarts[cell + 2]
+    # Cells beyond the last row are never occupied, so need no special case
+    first = cellId + nCols - (1 if col > 0 else 0)
+    last = cellId + nCols + (1 if col + 1 < nCols else 0)
+    nextRowStart = cellStarts[np.searchsorted(cellIds, first)]
+    nextRowEnd = cellStarts[np.searchsorted(cellIds, last + 1)]
+    return sameRowEnd, nextRowStart, nextRowEnd
+
+
+@njit("Tuple((int64[::1], int64[::1], float32[::1]))(float32[::1], float32[::1], int64[::1], int64[::1], int64, float32)",
+      parallel=True, fastmath=True, cache=True)
+def _closePairsKernel(x, y, cellIds, cellStarts, nCols, maxDistanceSq):
+    """
+    Finds all pairs of actors within the given distance of each other, once per pair with the lower actor index first.
+
+    This is the compiled equivalent of Simulation._pairsWithin, and returns pairs in the same order. The actor arrays must be
+    sorted by grid cell (See Simulation._sortByCell), and the distance must not exceed the grid's cellSize.
+
+    Args:
+        x:              ndarray float32 x position of each actor in metres
+        y:              ndarray float32 y position of each actor in metres
+        cellIds:        ndarray int64 The (sorted) grid cell number of each occupied cell
+        cellStarts:     ndarray int64 Index of the first actor in each occupied cell, plus a final entry of the actor count
+        nCols:          int The number of columns in the grid
+        maxDistanceSq:  float Square of the maximum distance between the pair in metres squared
+
+    Returns:
+        firstIdxs:      ndarray int64 Lower actor index of each pair
+        secondIdxs:     ndarray int64 Higher actor index of each pair (sorted by firstIdxs then secondIdxs)
+        distanceSq:     ndarray float32 Squared distance between each pair in metres squared
+    """
+    n = x.shape[0]
+    nCells = cellIds.shape[0]
+
+    # Count then fill, as for the tick kernel
+    counts = np.zeros(n, dtype=np.int64)
+    for cell in prange(nCells):
+        sameRowEnd, nextRowStart, nextRowEnd = _neighbourBlocks(cell, cellIds, cellStarts, nCols)
+        for i in range(cellStarts[cell], cellStarts[cell + 1]):
+            count = 0
+            for block in range(2):
+                start, end = (i + 1, sameRowEnd) if block == 0 else (nextRowStart, nextRowEnd)
+                for j in range(start, end):
+                    dx = x[i] - x[j]
+                    dy = y[i] - y[j]
+                    if dx * dx + dy * dy <= maxDistanceSq:
+                        count += 1
+            counts[i] = count
+    starts = np.zeros(n + 1, dtype=np.int64)
+    starts[1:] = np.cumsum(counts)
+
+    total = starts[n]
+    firstIdxs = np.empty(total, dtype=np.int64)
+    secondIdxs = np.empty(total, dtype=np.int64)
+    distanceSqs = np.empty(total, dtype=np.float32)
+    for cell in prange(nCells):
+        sameRowEnd, nextRowStart, nextRowEnd = _neighbourBlocks(cell, cellIds, cellStarts, nCols)
+        for i in range(cellStarts[cell], cellStarts[cell + 1]):
+            k = starts[i]
+            for block in range(2):
+                start, end = (i + 1, sameRowEnd) if block == 0 else (nextRowStart, nextRowEnd)
+                for j in range(start, end):
+                    dx = x[i] - x[j]
+                    dy = y[i] - y[j]
+                    distanceSq = dx * dx + dy * dy
+                    if distanceSq <= maxDistanceSq:
+                        firstIdxs[k] = i
+                        secondIdxs[k] = j
+                        distanceSqs[k] = distanceSq
+                        k += 1
+    return firstIdxs, secondIdxs, distanceSqs
+
+
+@njit("void(float32[::1], float32[::1], float32[::1], float32[::1], boolean[::1], boolean[::1], float32, float32, float32, float32, float32)",
+      fastmath=True, cache=True)
+def _moveKernel(X, Y, vx, vy, included, inMeeting, secondsElapsed, minX, maxX, minY, maxY):
+    """
+    Moves every included actor not in a meeting, then removes any actor outside the bounding box from consideration. Updates the arrays in place.
+
+    Both steps are written without branches (multiplying by the moving flag, and AND'ing comparisons) so the loop can be vectorised.
+
+    Args:
+        X:              ndarray float32 x position of each actor in metres
+        Y:              ndarray float32 y position of each actor in metres
+        vx:             ndarray float32 x velocity of each actor in metres per second
+        vy:             ndarray float32 y velocity of each actor in metres per second
+        included:       ndarray bool Whether each actor is still within the simulation
+        inMeeting:      ndarray bool Whether each actor is in a meeting (and so not moving)
+        secondsElapsed: float Seconds elapsed in the simulation since last movement
+        minX:           float The simulation square's minimum x value in metres
+        maxX:           float The simulation square's maximum x value in metres
+        minY:           float The simulation square's minimum y value in metres
+        maxY:           float The simulation square's maximum y value in metres
+    """
+    for i in range(X.shape[0]):
+        moving = np.float32(included[i] & (not inMeeting[i]))
+        X[i] += vx[i] * secondsElapsed * moving
+        Y[i] += vy[i] * secondsElapsed * moving
+        included[i] = included[i] & (X[i] >= minX) & (X[i] <= maxX) & (Y[i] >= minY) & (Y[i] <= maxY)
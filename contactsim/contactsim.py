@@ -7,12 +7,36 @@
 # This file contains the classes, and a sample app, for the 
 # contact simulation
 
+import csv
+import heapq
 import math
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import multiprocessing
+import os
+import sys
 import numpy as np
 import pandas as pd
 
-import scipy.stats as stats
-import random
+from scipy.spatial import cKDTree
+from scipy.special import erf
+
+try:
+    # Optional - used for fast (multi-threaded) output writing. See writeReadings
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+if __package__:
+    from . import _kernels
+else:
+    # Executed directly as a script (See the example application at the end of this file). Import the kernels
+    # as part of the contactsim package (not as a top level module) so that Numba's compiled cache can be reused
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from contactsim import _kernels
 
 class Actor:
     """
@@ -165,13 +189,42 @@ class Meeting:
 
 
 
+SPEED_OF_LIGHT = 2999100 # speed of light at sea level through air in m/s, as used by Simulation
+
+def friisConstant(frequency):
+    """
+    Calculates the constant part of the Friis formula for a frequency, so it need not be recalculated per pair of actors.
+
+    Receiver power is then powerTx + gainTx + gainRx + friisConstDb - 20*log10(distance), in dBm.
+
+    Args:
+        frequency:      float The frequency in Hertz (NOT MHz)
+
+    Returns:
+        friisConstDb:   float 20*log10(wavelength/(4*pi)) in dB
+    """
+    return 20 * math.log10((SPEED_OF_LIGHT / frequency) / (4 * math.pi))
+
+# Internal storage for each reading. Receiver and transmitter are actor serial numbers (See Simulation.addActor)
+_READING_DTYPE = np.dtype([("time", np.float64), ("receiver", np.int32), ("transmitter", np.int32), ("receiverPower", np.float32)])
+
+def _registryArray(values):
+    """
+    Converts a list of actor ids or device models to an ndarray, keeping numeric types but otherwise storing the original Python objects.
+    An empty list gives an (empty) object array, rather than NumPy's default of float.
+    """
+    array = np.asarray(values)
+    if len(values) > 0 and array.dtype.kind in "biuf":
+        return array
+    return np.asarray(values, dtype=object)
+
 class Simulation:
     """
     Controller class that manages the overall simulation. The main class you will work with in ContactSim.
 
     For an example, look at the `examples` folder, or execute this module directly. Output is generated in the `./output` folder.
     """
-    def __init__(self, actors, frequency, maxEffectRange, minX, maxX, minY, maxY, meetingDurationMean = 0, meetingDurationSd = 0, meetingDistanceMean = 0, meetingDistanceSd = 0, meetingChance = 0, meetingMaxRange = 3):
+    def __init__(self, actors, frequency, maxEffectRange, minX, maxX, minY, maxY, meetingDurationMean = 0, meetingDurationSd = 0, meetingDistanceMean = 0, meetingDistanceSd = 0, meetingChance = 0, meetingMaxRange = 3, rng = None, friisConstDb = None):
         """
         Creates a simulation instance.
 
@@ -198,47 +251,283 @@ class Simulation:
             maxX:                   float The simulation square's maximum x value to consider actors within. In metres.
             minY:                   float The simulation square's minimum y value to consider actors within. In metres.
             maxY:                   float The simulation square's maximum y value to consider actors within. In metres.
+                                    Any of the bounds may be infinite (E.g. -numpy.inf, numpy.inf), so actors are never removed in that direction.
             meetingDurationMean:    float (default 0) The mean meeting duration in seconds.
             meetingDurationSd:      float (default 0) The standard deviation of the meeting duration.
             meetingDistanceMean:    float (default 0) The mean meeting distance in metres.
             meetingDistanceSd:      float (default 0) The standard deviation of the meeting distance.
             meetingChange:          float (default 0 - disables meetings) The probability that a meeting will occur at each tick of the simulation, if distance <= meeting distance selected from the distance duration.
             meetingMaxRange:        float (default 3m) The maximum range a human to human meeting can occur, in metres. Does not effect maxEffectRange (which is instead the transmission detection distance).
+            rng:                    numpy.random.Generator (default None - a new unseeded Generator) The random number generator used to decide meetings and their durations. Pass a seeded Generator for reproducibility.
+            friisConstDb:           float (default None - calculated from frequency) The precomputed constant part of the Friis formula for this frequency. See friisConstant()
         """
-        self.actors = actors
+        # Actor state is held as parallel arrays (structure of arrays) rather than a list of Actor instances.
+        # Only the first actorCount entries of each array are in use, the rest is spare capacity.
+        # float32 is ample for positions within a few hundred metres and powers in dBm, and halves the memory traffic per tick.
+        self.actorCount = 0
+        self.X = np.empty(0, dtype=np.float32) # m
+        self.Y = np.empty(0, dtype=np.float32) # m
+        self.vx = np.empty(0, dtype=np.float32) # m/s
+        self.vy = np.empty(0, dtype=np.float32) # m/s
+        self.powerTx = np.empty(0, dtype=np.float32) # dBm
+        self.gainTx = np.empty(0, dtype=np.float32) # dBm
+        self.gainRx = np.empty(0, dtype=np.float32) # dBm
+        self.included = np.empty(0, dtype=bool)
+        self.ids = np.empty(0, dtype=object)
+        self.serial = np.empty(0, dtype=np.int32) # Index into _actorIds and _actorModelCodes, which record every actor ever added
+        self.modelCode = np.empty(0, dtype=np.uint16) # Index into _modelIds
+        self.inMeeting = np.empty(0, dtype=bool)
+        self.meetingStart = np.empty(0, dtype=np.float64) # s, of the actor's current (or most recent) meeting
+        self.meetingEnd = np.empty(0, dtype=np.float64) # s, of the actor's current (or most recent) meeting
+        self._idIndex = None # participantId -> actor array index, built on demand
+        self._serialIndex = None # actor serial -> actor array index (-1 if removed), built on demand
+        self._actorIds = []
+        self._actorModelCodes = []
+        self._modelIds = {} # device model -> its code. Models are interned as codes, as there are only ever a few distinct models
+        self.addActors(actors)
         self.radioFrequency = frequency
         self.maxRange = maxEffectRange
-        c = 2999100 # speed of light at sea level through air in m/s
+        c = SPEED_OF_LIGHT
         self.c = c
         wavelength = c / frequency
         self.wavelength = wavelength # do this conversion once for speed. Use wavelength from now on
+        # Friis: 20*log10(wavelength/(4*pi*distance)) == friisConst - 10*log10(distance^2), so no sqrt or division per pair
+        self._friisConst = np.float32(friisConstDb if friisConstDb is not None else friisConstant(frequency))
+        # Compiled kernel (if Numba is available) with this simulation's constants baked in
+        self._tick = _kernels.make_tick_kernel(self.maxRange, self.wavelength, float(self._friisConst)) if _kernels.NUMBA_AVAILABLE else None
         self.time = 0 # seconds
-        self.readings = [] # (timeSecond,idReceiver,idTransmitter,powerReceiver)
+        # Readings are appended to a preallocated buffer (doubled when full) rather than a list of tuples. See the readings property
+        self._readingsBuffer = np.empty(1024, dtype=_READING_DTYPE)
+        self._readingsCount = 0
         self.minX = minX
         self.minY = minY
         self.maxX = maxX
         self.maxY = maxY
         self.meetings = []
+        self.meetingIndex = {} # sorted participant id tuple -> Meeting
+        self._activeMeetings = [] # min-heap of (end, meeting number, participant serials) for meetings still in progress
+        self._metPairs = np.empty(0, dtype=np.int64) # sorted pair keys (See _pairKeys) of every pair that has ever met
+        self._meetingLog = [] # (idRx, idTx, time, range, probability, cdf, end) of each new meeting. See flushLog
+        self._logPaths = set() # paths already flushed to by this simulation, which later flushes append to
         self.meetingDurationMean = meetingDurationMean
         self.meetingDurationSd = meetingDurationSd
         self.meetingDistanceMean = meetingDistanceMean
         self.meetingDistanceSd = meetingDistanceSd
         self.meetingChance = meetingChance
         self.meetingMaxRange = meetingMaxRange
+        # Range tests are done on squared distances, so no sqrt is needed per pair
+        self._maxRange2 = self.maxRange * self.maxRange
+        self._meetingMaxRange2 = self.meetingMaxRange * self.meetingMaxRange
+        self._meetingDistThresh2 = (self.meetingDistanceMean + (2 * self.meetingDistanceSd)) ** 2
+        self._wavelength2 = self.wavelength * self.wavelength
+        self.rng = rng if rng is not None else np.random.default_rng()
+        # Uniform grid used to find nearby actors. A cell is at least as wide as any range we test so only neighbouring cells need checking
+        self.cellSize = max(self.maxRange, self.meetingMaxRange, self.wavelength)
+        self._gridMinX, self.nCols = self._gridAxis(np.empty(0), self.minX, self.maxX)
+        self._gridMinY, self.nRows = self._gridAxis(np.empty(0), self.minY, self.maxY)
+        # An infinite bound can't place the grid, so it is instead fitted around the actors each tick
+        self._gridFollowsActors = not all(math.isfinite(bound) for bound in (self.minX, self.maxX, self.minY, self.maxY))
+
+    # Above this many actors, the NumPy implementation finds nearby pairs using a KD-tree rather than comparing every pair (See _pairsWithin)
+    _DENSE_PAIRS_MAX = 32
+
+    # The most grid rows or columns, so that cell numbers always fit in an int64. Actors beyond are kept in the edge cells
+    _GRID_AXIS_MAX = 1 << 31
+
+    _ACTOR_ARRAYS = ("X", "Y", "vx", "vy", "powerTx", "gainTx", "gainRx", "included", "ids", "serial", "modelCode", "inMeeting", "meetingStart", "meetingEnd")
+
+    @property
+    def readings(self):
+        """
+        All readings recorded so far, as a NumPy structured array with one row per reading and the fields:-
+        time, receiverId, transmitterId, receiverPower, receiverDeviceModel, transmitterDeviceModel
+
+        This can be passed straight to pandas.DataFrame(). The array is built on each access, so fetch it once at the end of a simulation.
+
+        Returns:
+            readings:   ndarray Structured array of readings
+        """
+        n = self._readingsCount
+        buffer = self._readingsBuffer[:n]
+        ids = _registryArray(self._actorIds)
+        models = _registryArray(list(self._modelIds))[np.asarray(self._actorModelCodes, dtype=np.uint16)]
+        # Keep integer times if the simulation clock is an integer (I.e. all steps were whole seconds)
+        times = np.asarray(self.time).dtype if isinstance(self.time, (int, np.integer)) else np.float64
+        readings = np.empty(n, dtype=[("time", times), ("receiverId", ids.dtype), ("transmitterId", ids.dtype), ("receiverPower", np.float32),
+                                      ("receiverDeviceModel", models.dtype), ("transmitterDeviceModel", models.dtype)])
+        readings["time"] = buffer["time"]
+        readings["receiverId"] = ids[buffer["receiver"]]
+        readings["transmitterId"] = ids[buffer["transmitter"]]
+        readings["receiverPower"] = buffer["receiverPower"]
+        readings["receiverDeviceModel"] = models[buffer["receiver"]]
+        readings["transmitterDeviceModel"] = models[buffer["transmitter"]]
+        return readings
+
+    @property
+    def readingColumns(self):
+        """
+        All readings recorded so far, as a dict of column name to column array, with the same columns as the readings property.
+
+        Pass this to pandas.DataFrame(..., copy=False) to build a DataFrame column by column, without creating a row per reading.
+        The device model columns are pandas.Categorical, which take far less memory than a string per reading.
+
+        Returns:
+            readingColumns: dict Column arrays of readings, keyed by column name
+        """
+        n = self._readingsCount
+        buffer = self._readingsBuffer[:n]
+        ids = _registryArray(self._actorIds)
+        # Only the (few) distinct device models are stored, with each reading referring to one by its code
+        modelCodes = np.asarray(self._actorModelCodes, dtype=np.uint16)
+        models = _registryArray(list(self._modelIds))
+        # Keep integer times if the simulation clock is an integer (I.e. all steps were whole seconds)
+        times = np.asarray(self.time).dtype if isinstance(self.time, (int, np.integer)) else np.float64
+        receivers = buffer["receiver"]
+        transmitters = buffer["transmitter"]
+        return {
+            "time": buffer["time"].astype(times),
+            "receiverId": ids[receivers],
+            "transmitterId": ids[transmitters],
+            "receiverPower": buffer["receiverPower"].copy(),
+            "receiverDeviceModel": pd.Categorical.from_codes(modelCodes[receivers], models),
+            "transmitterDeviceModel": pd.Categorical.from_codes(modelCodes[transmitters], models),
+        }
+
+    def drainReadings(self):
+        """
+        Returns all readings recorded since the last drain (as for readingColumns) and removes them from the simulation.
+
+        Use this to write readings out every few steps (See ReadingsWriter), rather than holding every reading in memory until the end.
+
+        Returns:
+            readingColumns: dict Column arrays of readings, keyed by column name
+        """
+        readingColumns = self.readingColumns
+        self._readingsCount = 0
+        return readingColumns
+
+    @property
+    def actors(self):
+        """
+        The actors currently within the simulation (in the order they were added), as new Actor instances. This is a snapshot - changing these will not affect the simulation.
+
+        Returns:
+            actorArray:     []Actor An array of Actor instances reflecting the current simulation state
+        """
+        n = self.actorCount
+        models = list(self._modelIds)
+        actors = []
+        # The actor arrays are kept sorted by grid cell, so put them back in the order they were added
+        for i in np.argsort(self.serial[:n], kind="stable").tolist():
+            actor = Actor(self.ids[i], float(self.powerTx[i]), float(self.gainTx[i]), float(self.gainRx[i]), models[self.modelCode[i]])
+            actor.setPosition(float(self.X[i]), float(self.Y[i]))
+            # North is 0 radians, so the angle is measured from the y axis
+            actor.setVelocity(math.atan2(self.vx[i], self.vy[i]), math.hypot(self.vx[i], self.vy[i]))
+            actor.included = bool(self.included[i])
+            actors.append(actor)
+        return actors
 
     def addActor(self, newActor):
         """
         Adds an additional actor to the simulation. Useful for adding new actors part way through a simulation.
+
+        The actor's state is copied into the simulation, so later changes to the Actor instance have no effect.
         
         Args:
             actor:  Actor The new actor instance to add
         """
-        self.actors.append(newActor)
+        self.addActors([newActor])
+
+    def addActors(self, newActors):
+        """
+        Adds several additional actors to the simulation at once. Faster than calling addActor() for each.
+
+        The actors' state is copied into the simulation, so later changes to the Actor instances have no effect.
+
+        Args:
+            newActors:  []Actor The new actor instances to add
+
+        Raises:
+            ValueError: If an actor's id is already used by another actor in the simulation (or in newActors)
+        """
+        newActors = list(newActors)
+        count = len(newActors)
+        if count == 0:
+            return
+        # Ids must be unique, or readings could pair an actor with itself and meetings would be recorded against the wrong actor
+        idIndex = self._actorIdIndex()
+        newIds = set()
+        for actor in newActors:
+            if actor.id in idIndex or actor.id in newIds:
+                raise ValueError(f"Actor id {actor.id!r} is already used by another actor in the simulation")
+            newIds.add(actor.id)
+        modelCodes = [self._modelIds.setdefault(actor.deviceModel, len(self._modelIds)) for actor in newActors]
+        if len(self._modelIds) > np.iinfo(np.uint16).max + 1:
+            raise ValueError(f"Too many distinct device models (more than {np.iinfo(np.uint16).max + 1})")
+        start = self.actorCount
+        end = start + count
+        if end > len(self.X):
+            self._grow(max(16, 2 * len(self.X), end))
+        self.X[start:end] = [actor.x for actor in newActors]
+        self.Y[start:end] = [actor.y for actor in newActors]
+        # North is 0 radians (x left to right, y bottom to top, noth upwards/topwards)
+        angles = np.array([actor.angle for actor in newActors], dtype=np.float64)
+        speeds = np.array([actor.speed for actor in newActors], dtype=np.float64)
+        self.vx[start:end] = np.sin(angles) * speeds
+        self.vy[start:end] = np.cos(angles) * speeds
+        self.powerTx[start:end] = [actor.powerTx for actor in newActors]
+        self.gainTx[start:end] = [actor.gainTx for actor in newActors]
+        self.gainRx[start:end] = [actor.gainRx for actor in newActors]
+        self.included[start:end] = [actor.included for actor in newActors]
+        self.serial[start:end] = np.arange(len(self._actorIds), len(self._actorIds) + count)
+        for i, actor in enumerate(newActors, start):
+            self.ids[i] = actor.id
+            idIndex[actor.id] = i
+            self._actorIds.append(actor.id)
+        self.modelCode[start:end] = modelCodes
+        self._actorModelCodes.extend(modelCodes)
+        self.inMeeting[start:end] = False
+        self.meetingStart[start:end] = 0
+        self.meetingEnd[start:end] = 0
+        self.actorCount = end
+        self._serialIndex = None
+
+    def _grow(self, capacity):
+        """
+        Increases the capacity of the actor state arrays, keeping the actors currently in use.
+
+        Args:
+            capacity:   int The new number of actors the arrays can hold
+        """
+        n = self.actorCount
+        for name in self._ACTOR_ARRAYS:
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:n] = old[:n]
+            setattr(self, name, new)
+
+    def _compact(self):
+        """
+        Removes actors no longer included in the simulation from the actor state arrays, keeping the remaining actors in the same order.
+        """
+        n = self.actorCount
+        keep = self.included[:n].copy()
+        remaining = int(np.count_nonzero(keep))
+        if remaining == n:
+            return
+        for name in self._ACTOR_ARRAYS:
+            values = getattr(self, name)
+            values[:remaining] = values[:n][keep]
+        self.actorCount = remaining
+        self._idIndex = None
+        self._serialIndex = None
 
     def isInMeeting(self, participantId, tickNow):
         """
         Returns whether the given participant is in a meeting at the specified time (in ticks of the simulation, not seconds)
 
+        Only the participant's current meeting is considered, so tickNow should not be before the current simulation time.
+
         Args:
             participantId:  str The unique participant identifier
             tickNow:        int The time within the simulation (in simulation ticks, not seconds)
@@ -246,12 +535,21 @@ class Simulation:
         Returns:
             isInMeeting:    boolean If the participant is in a meeting
         """
-        # TODO use a data structure that makes this much quicker for lookups
-        for meeting in self.meetings:
-            if meeting.hasParticipant(participantId):
-                if meeting.stillMeeting(tickNow):
-                    return True
-        return False
+        i = self._actorIdIndex().get(participantId)
+        if i is None:
+            return False
+        return bool(self.inMeeting[i]) and (self.meetingStart[i] <= tickNow <= self.meetingEnd[i])
+
+    def _actorIdIndex(self):
+        """
+        Returns the map of participantId to actor array index for the current actors, building it if the actor arrays have changed.
+
+        Returns:
+            idIndex:        dict participantId -> actor array index
+        """
+        if self._idIndex is None:
+            self._idIndex = {id: i for i, id in enumerate(self.ids[:self.actorCount].tolist())}
+        return self._idIndex
     
     def getMeeting(self, participantIds):
         """
@@ -263,10 +561,27 @@ class Simulation:
         Returns:
             meeting:        Meeting|None Meeting instance or None if none match
         """
-        for meeting in self.meetings:
-            if sorted(meeting.participants) == sorted(participantIds):
-                return meeting
-        return None
+        return self.meetingIndex.get(tuple(sorted(participantIds)))
+
+    def flushLog(self, path):
+        """
+        Writes the log of every new meeting (who met, when, at what range, and why) since the last flush to a CSV file, then clears the log.
+
+        The log is buffered in memory rather than printed as each meeting happens, as printing within step() is slow for long simulations.
+        Call this as often as you like with the same path: the first flush to a path by this simulation replaces the file (and writes
+        the header), and later flushes append to it, so the file always holds every meeting logged so far.
+
+        Args:
+            path:           str The path of the CSV file to write
+        """
+        append = path in self._logPaths
+        with open(path, "a" if append else "w", newline = "") as logFile:
+            writer = csv.writer(logFile)
+            if not append:
+                writer.writerow(["receiverId", "transmitterId", "time", "range", "probability", "cdf", "endTime"])
+            writer.writerows(self._meetingLog)
+        self._logPaths.add(path)
+        self._meetingLog = []
 
     def step(self, secondsElapsed):
         """
@@ -277,75 +592,387 @@ class Simulation:
         """
         # Increment internal clock
         self.time += secondsElapsed
-        # Move each actor 1 step
-        remainingActors = []
-        for actor in self.actors:
-            if actor.included:
-                if not self.isInMeeting(actor.id, self.time):
-                    actor.updatePosition(secondsElapsed)
-                    # Remove them from consideration if out of the effective area (our simulation circle - using a bounding box for now for computational ease)
-                    if (actor.x < self.minX) or (actor.x > self.maxX) or (actor.y < self.minY) or actor.y > self.maxY:
-                        actor.included = False
-                    else:
-                        remainingActors.append(actor)
-                else:
-                    # Keep the ones who are in meetings!
-                    remainingActors.append(actor)
-
-        # remainingActors = []
-        # for actor in self.actors:
-        #     if actor.included:
-        #         remainingActors.append(actor)
-        self.actors = remainingActors
+        # Move each actor 1 step (Keep the ones who are in meetings where they are!)
+        # Then remove them from consideration if out of the effective area (our simulation circle - using a bounding box for now for computational ease)
+        # Actors in meetings have not moved since they were last checked, so can be checked again for free
+        n = self.actorCount
+        # Finish any meetings that have ended
+        self._expireMeetings()
+        if _kernels.NUMBA_AVAILABLE:
+            _kernels._moveKernel(self.X[:n], self.Y[:n], self.vx[:n], self.vy[:n], self.included[:n], self.inMeeting[:n],
+                                  secondsElapsed, self.minX, self.maxX, self.minY, self.maxY)
+        else:
+            X = self.X[:n]
+            Y = self.Y[:n]
+            active = self.included[:n] & ~self.inMeeting[:n]
+            X[active] += self.vx[:n][active] * secondsElapsed
+            Y[active] += self.vy[:n][active] * secondsElapsed
+            self.included[:n] &= (X >= self.minX) & (X <= self.maxX) & (Y >= self.minY) & (Y <= self.maxY)
+        self._compact()
 
         # Determine which are inside the area of effect
-        for rxIdx,actorRx in enumerate(self.actors):
-            for _,actorTx in enumerate(self.actors,start=rxIdx + 1):
-                if (actorRx.id != actorTx.id): # and actorRx.included and actorTx.included and 
-                    # Calculate mutual distance
-                    range = math.sqrt(math.pow(actorRx.x - actorTx.x, 2) + math.pow(actorRx.y - actorTx.y, 2))
-
-                    # Now filtered ones already in meetings
-                    # if not self.isInMeeting(actorRx.id,self.time) and not self.isInMeeting(actorTx.id,self.time): # This is computationally expensive
-
-
-                    # Check meetings are supported
-                    if (self.meetingDurationMean > 0) and (range <= self.meetingMaxRange):
-                        # Determine if our actors are newly within a meeting
-                        # If we have ever met, ignore (we can only meet one)
-                        meeting = self.getMeeting([actorRx.id,actorTx.id])
-                        if None == meeting:
-                            if range <= (self.meetingDistanceMean + (2 * self.meetingDistanceSd)): # minimises compute usage
-                                # calculate if we have met yet
-                                rnd = random.random()
-                                cdf = stats.norm.cdf(x = range, loc = self.meetingDistanceMean, scale = self.meetingDistanceSd) # was 1.0 - 
-                                if (rnd * self.meetingChance) > cdf :
-                                    # Have met
-                                    endTime = int(self.time + stats.norm.rvs(loc = self.meetingDurationMean, scale = self.meetingDurationSd))
-                                    if endTime < self.time + 1:
-                                        endTime = self.time + 1
-                                    self.meetings.append(Meeting(self.time,endTime, [actorRx.id,actorTx.id]))
-                                    print(f"Participant {actorRx.id} and {actorTx.id} have met at {self.time} at range {range} with probability {rnd} * { self.meetingChance} > {cdf} for {endTime-self.time}s")
-                                else:
-                                    # Have not met yet
-                                    pass
-
-                    # Ensure distance >= wavelength (Friis formula restriction)
-                    if (range <= self.maxRange) and (range >= self.wavelength):
-                        # Calculate Free Space Path Loss and Link Budget
-                        # fspl = (20 * math.log10(range)) + (20 * math.log10(self.radioFrequency)) + (20 * math.log10((4 * math.pi) / self.c)) # Could save this constant really...
-                        # linkBudget = actorTx.powerTx + actorTx.gainTx - fspl - actorRx.gainRx - 1.5 # assume minimal mobile phone receiver power (sensitivity)
-                        # maxRange = math.pow(10, linkBudget - actorTx.powerTx + 1.5 - fspl / (20 * math.log(self.radioFrequency)))
-                        # print(maxRange)
-
-                        # # Only record the value if the receiver is actually capable of receiving the transmission
-                        # if range <= maxRange:
-
-                            # Calculate mutual powerReceiver
-                            powerRx = actorRx.powerReceiver(self.wavelength,range,actorTx.powerTx,actorTx.gainTx)
-
-                            # Save value into data store
-                            self.readings.append((self.time, actorRx.id, actorTx.id, powerRx, actorRx.deviceModel, actorTx.deviceModel))
+        if self.actorCount < 2:
+            return
+        cellIds, cellStarts = self._sortByCell()
+        x, y, powerTx, gainTx, gainRx = self._gather_positions()
+
+        # Check meetings are supported
+        if self.meetingDurationMean > 0:
+            # Only the (usually tiny) set of pairs within meeting range need Python-side logic
+            if _kernels.NUMBA_AVAILABLE:
+                firstIdxs, secondIdxs, distanceSq = _kernels._closePairsKernel(x, y, cellIds, cellStarts, self.nCols, self._meetingMaxRange2)
+            else:
+                firstIdxs, secondIdxs, distanceSq = self._pairsWithin(x, y, self._meetingMaxRange2)
+            close = distanceSq <= self._meetingDistThresh2 # minimises compute usage
+            firstIdxs = firstIdxs[close]
+            secondIdxs = secondIdxs[close]
+            distanceSq = distanceSq[close]
+            # We can only meet once, so pairs that have already met need no more trials (nor random draws)
+            pairKeys = self._pairKeys(firstIdxs, secondIdxs)
+            notMet = ~self._hasMet(pairKeys)
+            # Each ordered (rx,tx) direction of a pair has its own chance of meeting each tick
+            rxIdxs, txIdxs = self._bothDirections(firstIdxs[notMet], secondIdxs[notMet])
+            pairKeys = np.repeat(pairKeys[notMet], 2)
+            # Only the few close pairs need the actual range (for the CDF)
+            ranges = np.repeat(np.sqrt(distanceSq[notMet]), 2)
+            # calculate if we have met yet, for every candidate pair in one go (using one block of random draws, not a draw per pair)
+            rnds = self.rng.random(len(ranges))
+            with np.errstate(divide = "ignore", invalid = "ignore"):
+                # Normal distribution CDF (was 1.0 - )
+                cdfs = 0.5 * (1 + erf((ranges - self.meetingDistanceMean) / (self.meetingDistanceSd * math.sqrt(2))))
+            durations = self.rng.normal(self.meetingDurationMean, self.meetingDurationSd, size = len(ranges))
+            met = (rnds * self.meetingChance) > cdfs
+            for rxIdx, txIdx, range, rnd, cdf, duration in zip(rxIdxs[met].tolist(), txIdxs[met].tolist(), ranges[met].tolist(),
+                                                               rnds[met].tolist(), cdfs[met].tolist(), durations[met].tolist()):
+                idRx = self.ids[rxIdx]
+                idTx = self.ids[txIdx]
+                # Determine if our actors are newly within a meeting
+                # If we have ever met (including earlier in this tick), ignore (we can only meet once)
+                if None == self.getMeeting([idRx,idTx]):
+                    # Have met
+                    endTime = int(self.time + duration)
+                    if endTime < self.time + 1:
+                        endTime = self.time + 1
+                    meeting = Meeting(self.time,endTime, [idRx,idTx])
+                    heapq.heappush(self._activeMeetings, (endTime, len(self.meetings), (self.serial[rxIdx], self.serial[txIdx])))
+                    self.meetings.append(meeting)
+                    self.meetingIndex[tuple(sorted(meeting.participants))] = meeting
+                    for idx in (rxIdx, txIdx):
+                        if not self.inMeeting[idx]:
+                            self.inMeeting[idx] = True
+                            self.meetingStart[idx] = self.time
+                            self.meetingEnd[idx] = endTime
+                        else:
+                            # Already in another meeting - stay put until both are over
+                            self.meetingEnd[idx] = max(self.meetingEnd[idx], endTime)
+                    self._meetingLog.append((idRx, idTx, self.time, range, rnd, cdf, endTime))
+            if np.any(met):
+                self._metPairs = np.union1d(self._metPairs, pairKeys[met])
+
+        # Calculate mutual powerReceiver (vectorised equivalent of Actor.powerReceiver)
+        if self._tick is not None:
+            rxIdxs, txIdxs, powerRx = self._tick(x, y, powerTx, gainTx, gainRx, cellIds, cellStarts, self.nCols)
+        else:
+            firstIdxs, secondIdxs, distanceSq = self._pairsWithin(x, y, self._maxRange2)
+            # Ensure distance >= wavelength (Friis formula restriction)
+            farEnough = distanceSq >= self._wavelength2
+            # Each pair's distance is calculated once, and is heard in both directions
+            rxIdxs, txIdxs = self._bothDirections(firstIdxs[farEnough], secondIdxs[farEnough])
+            pathGain = np.repeat(self._friisConst - (10 * np.log10(distanceSq[farEnough])), 2)
+            powerRx = gainRx[rxIdxs] + powerTx[txIdxs] + gainTx[txIdxs] + pathGain # dBm
+
+        # Save values into data store
+        count = len(powerRx)
+        start = self._readingsCount
+        if start + count > len(self._readingsBuffer):
+            self._readingsBuffer = np.resize(self._readingsBuffer, max(2 * len(self._readingsBuffer), start + count))
+        newReadings = self._readingsBuffer[start:start + count]
+        newReadings["time"] = self.time
+        newReadings["receiver"] = self.serial[rxIdxs]
+        newReadings["transmitter"] = self.serial[txIdxs]
+        newReadings["receiverPower"] = powerRx
+        self._readingsCount = start + count
+
+    def _expireMeetings(self):
+        """
+        Pops meetings that have ended off the active meetings heap, releasing participants that are not still in another meeting.
+        """
+        while self._activeMeetings and self._activeMeetings[0][0] < self.time:
+            _, _, serials = heapq.heappop(self._activeMeetings)
+            if self._serialIndex is None:
+                n = self.actorCount
+                self._serialIndex = np.full(len(self._actorIds), -1, dtype=np.int64)
+                self._serialIndex[self.serial[:n]] = np.arange(n)
+            for serial in serials:
+                idx = self._serialIndex[serial]
+                if idx >= 0 and self.meetingEnd[idx] < self.time:
+                    self.inMeeting[idx] = False
+
+    def _pairKeys(self, firstIdxs, secondIdxs):
+        """
+        Creates a single integer key for each pair of actors, from their serial numbers. The key is the same whichever order the pair is given in.
+
+        Args:
+            firstIdxs:      ndarray One actor index of each pair
+            secondIdxs:     ndarray The other actor index of each pair
+
+        Returns:
+            pairKeys:       ndarray int64 The key of each pair
+        """
+        firstSerials = self.serial[firstIdxs].astype(np.int64)
+        secondSerials = self.serial[secondIdxs].astype(np.int64)
+        return (np.minimum(firstSerials, secondSerials) << 32) | np.maximum(firstSerials, secondSerials)
+
+    def _hasMet(self, pairKeys):
+        """
+        Returns whether each pair of actors has ever met.
+
+        Args:
+            pairKeys:       ndarray int64 The key of each pair (See _pairKeys)
+
+        Returns:
+            hasMet:         ndarray bool Whether each pair has met
+        """
+        if len(self._metPairs) == 0:
+            return np.zeros(len(pairKeys), dtype=bool)
+        positions = np.minimum(np.searchsorted(self._metPairs, pairKeys), len(self._metPairs) - 1)
+        return self._metPairs[positions] == pairKeys
+
+    def _gather_positions(self):
+        """
+        Returns the in use portion of the actor position and radio property arrays, for vectorised calculations within a tick.
+
+        Returns:
+            x:          ndarray x position of each actor in metres
+            y:          ndarray y position of each actor in metres
+            powerTx:    ndarray Transmission Power (TxPower) of each actor in dBm
+            gainTx:     ndarray Transmitter Gain (TxGain) of each actor in dBm
+            gainRx:     ndarray Receiver Gain (RxGain) of each actor in dBm
+        """
+        n = self.actorCount
+        return self.X[:n], self.Y[:n], self.powerTx[:n], self.gainTx[:n], self.gainRx[:n]
+
+    def _gridCells(self, x, y):
+        """
+        Finds the cell of the uniform grid (of cellSize square cells covering the simulation space) that each actor is in.
+
+        Args:
+            x:              ndarray x position of each actor in metres
+            y:              ndarray y position of each actor in metres
+
+        Returns:
+            cellCol:        ndarray The grid column of each actor
+            cellRow:        ndarray The grid row of each actor
+            cells:          ndarray The grid cell number (row * nCols + column) of each actor
+        """
+        # Clipping keeps any actor outside the bounding box (E.g. in a meeting) in an edge cell - distances only shrink so no pairs are lost
+        # (In float64, as positions are float32 and a distant grid origin would otherwise lose their precision)
+        cellCol = np.clip(((x.astype(np.float64) - self._gridMinX) // self.cellSize).astype(np.int64), 0, self.nCols - 1)
+        cellRow = np.clip(((y.astype(np.float64) - self._gridMinY) // self.cellSize).astype(np.int64), 0, self.nRows - 1)
+        return cellCol, cellRow, (cellRow * self.nCols) + cellCol
+
+    def _gridAxis(self, positions, low, high):
+        """
+        Places the grid along one axis, covering the simulation space between its bounds. An infinite bound is replaced by the furthest actor.
+
+        Args:
+            positions:      ndarray The actors' positions along this axis in metres
+            low:            float The simulation space's minimum along this axis in metres
+            high:           float The simulation space's maximum along this axis in metres
+
+        Returns:
+            origin:         float The start of the first grid cell along this axis in metres
+            cellCount:      int The number of grid cells along this axis
+        """
+        if not math.isfinite(low):
+            low = float(positions.min()) if len(positions) > 0 else 0.0
+        if not math.isfinite(high):
+            high = float(positions.max()) if len(positions) > 0 else low
+        return low, min(int((high - low) / self.cellSize) + 1, self._GRID_AXIS_MAX)
+
+    def _sortByCell(self):
+        """
+        Reorders the actor state arrays by grid cell, so that actors near each other are also near each other in memory.
+
+        Actors move slowly relative to the cell size, so the arrays are nearly sorted already and this is cheap. Only the occupied
+        cells are listed, so the result (and the kernels' work) is proportional to the number of actors, not to the grid's size.
+
+        Returns:
+            cellIds:        ndarray The (sorted) grid cell number of each occupied cell
+            cellStarts:     ndarray Index of the first actor in each occupied cell, plus a final entry of the actor count
+        """
+        n = self.actorCount
+        if self._gridFollowsActors:
+            self._gridMinX, self.nCols = self._gridAxis(self.X[:n], self.minX, self.maxX)
+            self._gridMinY, self.nRows = self._gridAxis(self.Y[:n], self.minY, self.maxY)
+        _, _, cells = self._gridCells(self.X[:n], self.Y[:n])
+        if np.any(cells[1:] < cells[:-1]):
+            order = np.argsort(cells, kind="stable")
+            for name in self._ACTOR_ARRAYS:
+                values = getattr(self, name)
+                values[:n] = values[:n][order]
+            cells = cells[order]
+            self._idIndex = None
+            self._serialIndex = None
+        firsts = np.flatnonzero(np.diff(cells, prepend = -1))
+        return cells[firsts], np.append(firsts, n)
+
+    def _pairsWithin(self, x, y, maxDistanceSq):
+        """
+        Finds all pairs of actors within the given distance of each other, once per pair with the lower actor index first.
+
+        This is the NumPy equivalent of _kernels._closePairsKernel, and returns pairs in the same order. Rather than the grid, nearby
+        pairs are found with a KD-tree (built and queried in O(N log N)), so only the few pairs actually in range are ever formed.
+
+        Args:
+            x:              ndarray x position of each actor in metres
+            y:              ndarray y position of each actor in metres
+            maxDistanceSq:  float Square of the maximum distance between the pair in metres squared
+
+        Returns:
+            firstIdxs:      ndarray Lower actor index of each pair
+            secondIdxs:     ndarray Higher actor index of each pair (sorted by firstIdxs then secondIdxs)
+            distanceSq:     ndarray Squared distance between each pair in metres squared
+        """
+        if len(x) <= self._DENSE_PAIRS_MAX:
+            # For few actors, broadcasting every pair at once is quicker than building a tree. np.nonzero returns pairs already in order
+            dx = np.subtract.outer(x, x)
+            dy = np.subtract.outer(y, y)
+            distanceSqs = dx * dx + dy * dy
+            firstIdxs, secondIdxs = np.nonzero(np.triu(distanceSqs <= maxDistanceSq, 1))
+            return firstIdxs, secondIdxs, distanceSqs[firstIdxs, secondIdxs]
+        # The tree measures distance in float64, so query very slightly further and filter on the float32 distance, as the kernels do
+        pairs = cKDTree(np.column_stack((x, y))).query_pairs(math.sqrt(maxDistanceSq) * (1 + 1e-5), output_type = "ndarray")
+        order = np.lexsort((pairs[:, 1], pairs[:, 0]))
+        firstIdxs = pairs[order, 0]
+        secondIdxs = pairs[order, 1]
+        dx = x[firstIdxs] - x[secondIdxs]
+        dy = y[firstIdxs] - y[secondIdxs]
+        distanceSq = dx * dx + dy * dy
+        keep = distanceSq <= maxDistanceSq
+        return firstIdxs[keep], secondIdxs[keep], distanceSq[keep]
+
+    @staticmethod
+    def _bothDirections(firstIdxs, secondIdxs):
+        """
+        Expands each pair into its two (rx,tx) directions - first receiving from second, immediately followed by second receiving from first.
+
+        Args:
+            firstIdxs:      ndarray One actor index of each pair
+            secondIdxs:     ndarray The other actor index of each pair
+
+        Returns:
+            rxIdxs:         ndarray Receiver actor index of each direction
+            txIdxs:         ndarray Transmitter actor index of each direction
+        """
+        rxIdxs = np.column_stack((firstIdxs, secondIdxs)).ravel()
+        txIdxs = np.column_stack((secondIdxs, firstIdxs)).ravel()
+        return rxIdxs, txIdxs
+
+
+class ReadingsWriter:
+    """
+    The ReadingsWriter class writes readings to a file in batches, so a whole simulation's readings never need to be held in memory.
+
+    Output format is chosen by the file extension. A '.parquet' path is written as zstd compressed Parquet (much smaller and faster
+    to write and load than CSV, requires pyarrow). Any other path is written as CSV, using pyarrow's multi-threaded CSV writer if
+    it is installed and pandas otherwise. Use as a context manager, or call close() when finished.
+    """
+    def __init__(self, path):
+        """
+        Creates a new ReadingsWriter instance. A CSV output file is created (or replaced) straight away. A Parquet file needs the schema
+        of the first non-empty batch, so is only created by the first write() of any readings - any existing Parquet file at the path is removed now instead.
+
+        Args:
+            path:           str The path of the file to write
+        """
+        self.path = path
+        self.rowCount = 0
+        self._parquet = path.endswith(".parquet")
+        self._parquetWriter = None
+        self._schema = None
+        self._headerWritten = False
+        if self._parquet:
+            self._file = None
+            # Don't leave an earlier run's output in place if no readings are ever written
+            if os.path.exists(path):
+                os.remove(path)
+        elif PYARROW_AVAILABLE:
+            self._file = open(path, "wb")
+        else:
+            self._file = open(path, "w", newline = "")
+
+    def write(self, readings):
+        """
+        Appends a batch of readings to the file.
+
+        Args:
+            readings:       pandas.DataFrame|dict The readings to write, as a DataFrame or as column arrays (See Simulation.drainReadings)
+        """
+        df = readings if isinstance(readings, pd.DataFrame) else pd.DataFrame(readings, copy = False)
+        if self._parquet:
+            if self._parquetWriter is None and len(df) == 0:
+                # An empty batch's column types can't be relied on (E.g. no ids to tell strings from nulls), so take the schema from the first real batch
+                return
+            table = pa.Table.from_pandas(df, preserve_index = False)
+            if self._parquetWriter is None:
+                # Fix a wide dictionary index type up front, as later batches may have more device models than the first
+                self._schema = pa.schema([pa.field(field.name, pa.dictionary(pa.int32(), field.type.value_type)) if pa.types.is_dictionary(field.type) else field
+                                          for field in table.schema])
+                self._parquetWriter = pq.ParquetWriter(self.path, self._schema, compression = "zstd")
+            self._parquetWriter.write_table(table.cast(self._schema))
+        elif PYARROW_AVAILABLE and not self._needsQuoting(df):
+            table = pa.Table.from_pandas(df, preserve_index = False)
+            if not self._headerWritten:
+                # Write the header ourselves so it matches pandas (pyarrow always quotes header names)
+                self._file.write((",".join(table.column_names) + "\n").encode())
+            pacsv.write_csv(table, self._file, pacsv.WriteOptions(include_header = False, quoting_style = "none"))
+        elif PYARROW_AVAILABLE:
+            # pyarrow either quotes every string or none, so let pandas quote just the values that need it (as it does without pyarrow)
+            self._file.write(df.to_csv(header = not self._headerWritten, index = False).encode())
+        else:
+            df.to_csv(self._file, header = not self._headerWritten, index = False) #, float_format='%.3f')
+        self._headerWritten = True
+        self.rowCount += len(df)
+
+    @staticmethod
+    def _needsQuoting(df):
+        """
+        Whether any text value in the readings contains a comma, quote or line break, and so must be quoted in CSV.
+
+        Args:
+            df:             pandas.DataFrame The readings to check
+
+        Returns:
+            needsQuoting:   bool True if any value needs quoting
+        """
+        for name in df.columns:
+            column = df[name]
+            if isinstance(column.dtype, pd.CategoricalDtype):
+                # Only the (few) distinct values need checking
+                column = column.cat.categories.to_series()
+            elif column.dtype.kind not in "OSU" and not pd.api.types.is_string_dtype(column.dtype):
+                continue
+            if column.astype(str).str.contains(r'[,"\r\n]').any():
+                return True
+        return False
+
+    def close(self):
+        """
+        Finishes writing and closes the file. If no readings were written, a CSV file is left empty and no Parquet file is created.
+        """
+        if self._parquetWriter is not None:
+            self._parquetWriter.close()
+            self._parquetWriter = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        self.close()
 
 
 def txPowerNamer(actorToName):
@@ -361,7 +988,7 @@ def noneNamer(actorToName):
     """
     pass
 
-def generateActors(actorCount, meanSpeed, txPowerMethod="fixed", meanTxPower=13, txGainMethod="fixed",meanTxGain=1.5, rxSensitivityMethod="fixed",meanRxSensitivity=1.5, namer = txPowerNamer):
+def generateActors(actorCount, meanSpeed, txPowerMethod="fixed", meanTxPower=13, txGainMethod="fixed",meanTxGain=1.5, rxSensitivityMethod="fixed",meanRxSensitivity=1.5, namer = txPowerNamer, rng = None, firstId = 1):
     """
     Utility function to generate a set of actors given some boundary parameters.
 
@@ -380,101 +1007,155 @@ def generateActors(actorCount, meanSpeed, txPowerMethod="fixed", meanTxPower=13,
         rxSensitivityMethod:    str (default: 'fixed') The method used to select each actor's RxSensitivity (aka RxPower). Can be 'gaussian'.
         meanRxSensitivity:      float (default 1.5) The mean RxPower / sensitivity to select the RxPower from
         namer:                  function(Actor) (default txPowerNamer()) The device model namer function
+        rng:                    numpy.random.Generator (default None - a new unseeded Generator) The random number generator to use. Pass a seeded Generator for reproducibility.
+        firstId:                int (default 1) The id of the first actor generated. Following actors are numbered sequentially. Use to keep ids unique across calls.
 
     Returns:
         actorArray:             []Actor An array of Actor instances you can then add to a simulation
     """
-    actors = []
-    rng = np.random.default_rng()
+    if rng is None:
+        rng = np.random.default_rng()
     facePositionAngles = rng.uniform(0,2.0 * math.pi, actorCount)
     directionAngleDiffs = rng.uniform(0, math.pi, actorCount)
 
-    for i in range(actorCount):
-        # Calculate position from the centre of a 200m radius circle
-        x = 200.0 * math.sin(facePositionAngles[i])
-        y = 200.0 * math.cos(facePositionAngles[i])
-        # Calculate direction based on opposite of angle, plus 90 degrees, minus directionAngleDiffs
-        angle = facePositionAngles[i] + (1.5*math.pi) - directionAngleDiffs[i]
-        speed = meanSpeed # For now, one single speed
-        # meanTxPower = 13 # Class 1 BLE is < 20 dBm
-        
-        # Two choices: Fixed or Gaussian
-        txPower = meanTxPower
-        txGain = meanTxGain
-        rxSensitivity = meanRxSensitivity
-        
-        if txPowerMethod == "gaussian":
-            txPower = rng.normal(meanTxPower, 4)
-            if txPower < 0.0:
-                txPower = 0.0
-            # regularise txPower to an integer
-            txPower = int(math.floor(txPower))
-
-        if txGainMethod == "gaussian":
-            txGain = rng.normal(meanTxGain, 2)
-            if txGain < 0.0:
-                txGain = 0.0
-            # regularise txGain to an approx power accurate to 0.5 dBm
-            txGain = math.floor(txGain*2)/2 # Normalise to nearest 0.5 dBm
-        
-        if rxSensitivityMethod == "gaussian":
-            rxSensitivity = rng.normal(meanRxSensitivity, 2)
-            if rxSensitivity < 0.0:
-                rxSensitivity = 0.0
-            # regularise rxSensitivity to an approx power accurate to 0.5 dBm
-            rxSensitivity = math.floor(rxSensitivity*2)/2 # Normalise to nearest 0.5 dBm
+    # Calculate position from the centre of a 200m radius circle
+    xs = 200.0 * np.sin(facePositionAngles)
+    ys = 200.0 * np.cos(facePositionAngles)
+    # Calculate direction based on opposite of angle, plus 90 degrees, minus directionAngleDiffs
+    angles = facePositionAngles + (1.5*math.pi) - directionAngleDiffs
+    speed = meanSpeed # For now, one single speed
+    # meanTxPower = 13 # Class 1 BLE is < 20 dBm
+
+    # Two choices: Fixed or Gaussian. All actors are drawn at once rather than one at a time
+    txPowers = [meanTxPower] * actorCount
+    txGains = [meanTxGain] * actorCount
+    rxSensitivities = [meanRxSensitivity] * actorCount
 
+    if txPowerMethod == "gaussian":
+        # regularise txPower to an integer
+        txPowers = np.floor(np.clip(rng.normal(meanTxPower, 4, actorCount), 0.0, None)).astype(int).tolist()
+
+    if txGainMethod == "gaussian":
+        # regularise txGain to an approx power accurate to 0.5 dBm
+        txGains = (np.floor(np.clip(rng.normal(meanTxGain, 2, actorCount), 0.0, None) * 2) / 2).tolist() # Normalise to nearest 0.5 dBm
+
+    if rxSensitivityMethod == "gaussian":
+        # regularise rxSensitivity to an approx power accurate to 0.5 dBm
+        rxSensitivities = (np.floor(np.clip(rng.normal(meanRxSensitivity, 2, actorCount), 0.0, None) * 2) / 2).tolist() # Normalise to nearest 0.5 dBm
+
+    actors = []
+    for i, (x, y, angle, txPower, txGain, rxSensitivity) in enumerate(zip(xs.tolist(), ys.tolist(), angles.tolist(), txPowers, txGains, rxSensitivities)):
         # Create a device model name from this txPower
         # deviceModel = f"model{txPower:03d}"
-        newActor = Actor(i + 1, txPower, txGain, rxSensitivity)
+        newActor = Actor(firstId + i, txPower, txGain, rxSensitivity)
         newActor.setPosition(x,y)
         newActor.setVelocity(angle,speed)
         namer(newActor)
         actors.append(newActor)
 
-
     return actors
 
-# Example application:-
-if __name__ == "__main__":
+def actorStream(batchSize, batchCount, meanSpeed, rng = None, firstId = 1, **kwargs):
+    """
+    Utility function to lazily generate batches of actors, E.g. those to introduce at each step of a simulation.
 
-    actorCount = 30
-    stepSizeSeconds = 0.1
-    simDurationSeconds = 120
-    simRadius = 200
-    newActorsPerTimeStep = 2
+    Only one batch of Actor instances exists at a time, rather than every actor for the whole simulation being created up front.
 
-    simDurationSteps = simDurationSeconds / stepSizeSeconds
-    maxSteps = int(simDurationSteps)
+    Args:
+        batchSize:              int The number of actors in each batch
+        batchCount:             int The number of batches to generate
+        meanSpeed:              float Mean speed in metres per second (See generateActors)
+        rng:                    numpy.random.Generator (default None - a new unseeded Generator) The random number generator to use for every batch
+        firstId:                int (default 1) The id of the first actor generated. Following actors (across all batches) are numbered sequentially.
+        kwargs:                 Any other settings to pass to generateActors()
 
-    # Create a set of actors and their initial positions
-    maxRange = 15 # m max range to bother calculating Receiver power
-    frequency = ((2402 + 2426 + 2480) / 3.0) * 1000000 # Bluetooth mean ADVERTISING frequency
-    actors = []
+    Returns:
+        actorBatches:           generator of []Actor Each batch of Actor instances, in turn
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    for batch in range(batchCount):
+        yield generateActors(batchSize, meanSpeed, rng = rng, firstId = firstId + (batch * batchSize), **kwargs)
 
-    meanSpeed = (3 * 1.60934 * 1000) / (60 * 60) # 3 mph into m/s ~= 1.341m/s
+def runSingle(seed, actorCount = 30, stepSizeSeconds = 0.1, simDurationSeconds = 120, simRadius = 200, newActorsPerTimeStep = 2, maxRange = 15,
+              frequency = ((2402 + 2426 + 2480) / 3.0) * 1000000, meanSpeed = (3 * 1.60934 * 1000) / (60 * 60)):
+    """
+    Runs a single simulation of actors walking through a circular area, with new actors arriving at each step. This is the example application.
+
+    Args:
+        seed:                   int The random seed for this run. Runs with the same seed and settings produce the same readings.
+        actorCount:             int (default 30) The number of actors at the start of the simulation
+        stepSizeSeconds:        float (default 0.1) The simulation tick size in seconds
+        simDurationSeconds:     float (default 120) The duration of the simulation in seconds
+        simRadius:              float (default 200) Half the width of the simulation square in metres
+        newActorsPerTimeStep:   int (default 2) The number of new actors added at every tick
+        maxRange:               float (default 15) The maximum range to bother calculating Receiver power in metres
+        frequency:              float (default Bluetooth mean ADVERTISING frequency) The frequency in Hertz
+        meanSpeed:              float (default 3 mph ~= 1.341m/s) The actor speed in metres per second
 
-    # set random seed for reproducibility
-    np.random.seed(19680801)
+    Returns:
+        readings:               pandas.DataFrame The readings recorded by the simulation
+    """
+    simDurationSteps = simDurationSeconds / stepSizeSeconds
+    maxSteps = int(simDurationSteps)
+
+    # Each run has its own seeded generator, so runs are reproducible and independent of each other
+    rng = np.random.default_rng(seed)
     # Generate our initial actors
-    actors = generateActors(actorCount, meanSpeed)
+    actors = generateActors(actorCount, meanSpeed, rng = rng)
 
-    # calculate actors to introduce each time step
-    extraActorsCount = newActorsPerTimeStep * maxSteps
-    extraActors = generateActors(extraActorsCount, meanSpeed)
+    # calculate actors to introduce each time step (generated as they are needed)
+    extraActors = actorStream(newActorsPerTimeStep, maxSteps, meanSpeed, rng = rng, firstId = actorCount + 1)
 
-    # Run the simulation for 100 seconds at 0.1 second increments (10000 steps)
-    sim = Simulation(actors, frequency, maxRange, -simRadius, simRadius,-simRadius,simRadius)
-    for i in range(maxSteps):
-        print(f"Simulation step {i + 1}, with actor count: {len(sim.actors)}")
+    sim = Simulation(actors, frequency, maxRange, -simRadius, simRadius,-simRadius,simRadius, rng = rng)
+    # extraActors yields one batch of new actors per step
+    for newActors in extraActors:
         # Add extra actors
-        for newActorI in range(newActorsPerTimeStep):
-            sim.addActor(extraActors[(i * newActorsPerTimeStep) + newActorI])
+        sim.addActors(newActors)
         sim.step(stepSizeSeconds)
-    # Save the output data
-    data = sim.readings
-    df = pd.DataFrame(data, columns = ['time','receiverId','transmitterId','receiverPower','receiverDeviceModel','transmitterDeviceModel'])
+    return pd.DataFrame(sim.readingColumns, copy = False)
+
+def writeReadings(df, path):
+    """
+    Writes a readings DataFrame to disk in one go. Output format is chosen by the file extension (See ReadingsWriter).
+
+    Args:
+        df:             pandas.DataFrame The readings to write (See runSingle)
+        path:           str The path of the file to write
+    """
+    with ReadingsWriter(path) as writer:
+        writer.write(df)
+
+def runEnsemble(runCount, seeds = None, maxWorkers = None, **kwargs):
+    """
+    Runs several independent simulations (an ensemble, for Monte-Carlo studies) in parallel, one per process.
+
+    Args:
+        runCount:       int The number of simulations to run
+        seeds:          []int (default None - 0 to runCount-1) The random seed of each run. If given, there must be exactly runCount seeds
+        maxWorkers:     int (default None - one per CPU) The maximum number of worker processes
+        kwargs:         Any other settings to pass to runSingle()
+
+    Returns:
+        readingsArray:  []pandas.DataFrame The readings of each run, in the same order as seeds
+
+    Raises:
+        ValueError: If seeds is given but does not have runCount seeds
+    """
+    if seeds is None:
+        seeds = range(runCount)
+    elif len(seeds) != runCount:
+        raise ValueError(f"Expected {runCount} seeds (one per run), but was given {len(seeds)}")
+    # Spawn (not fork) fresh workers - forking after compiled kernels have started their thread pool can deadlock
+    with ProcessPoolExecutor(max_workers = maxWorkers, mp_context = multiprocessing.get_context("spawn")) as executor:
+        return list(executor.map(partial(runSingle, **kwargs), seeds))
+
+# Example application:-
+if __name__ == "__main__":
+
+    # Run the simulation for 120 seconds at 0.1 second increments (1200 steps)
+    # (set random seed for reproducibility)
+    df = runSingle(19680801)
     print(df)
 
-    # The below takes time because of the use of float_format to make the time look sensible
-    df.to_csv("./output/sim-output.csv", index=False) #, float_format='%.3f')
\ No newline at end of file
+    writeReadings(df, "./output/sim-output.csv")
@@ -6,41 +6,127 @@
 
 # This file contains scenarios that exercise the contactsim module.
 
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+import logging
+import math
+import multiprocessing
+import os
+
 # Incude the LOCAL contact sim, not the published module (You won't do this in your own files once we publish a module!)
 import sys
 sys.path.append("..")
 
 import arguably
 import numpy as np
-import pandas as pd
 
 # import contactsim.contactsim as contactsim
-from contactsim.contactsim import generateActors,Simulation
+from contactsim.contactsim import actorStream,friisConstant,generateActors,Simulation,ReadingsWriter
 
 
-# Declare general defaults now
+logger = logging.getLogger(__name__)
 
-actorCount = 30
-# stepSizeSeconds = 0.1
-# simDurationSeconds = 120
-stepSizeSeconds = 5
-simDurationSeconds = 1200
-simRadius = 200
-newActorsPerTimeStep = 2
+def configureLogging():
+    """
+    Shows progress messages on the console. Called at startup, and by each worker process of the all command.
+    """
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
 
-simDurationSteps = simDurationSeconds / stepSizeSeconds
-maxSteps = int(simDurationSteps)
+# Declare general defaults now
 
-# Create a set of actors and their initial positions
-maxRange = 15 # m max range to bother calculating Receiver power
-frequency = ((2402 + 2426 + 2480) / 3.0) * 1000000 # Bluetooth mean ADVERTISING frequency
-actors = []
+BLUETOOTH_FREQUENCY = ((2402 + 2426 + 2480) / 3.0) * 1000000 # Bluetooth mean ADVERTISING frequency
 
-meanSpeed = (3 * 1.60934 * 1000) / (60 * 60) # 3 mph into m/s ~= 1.341m/s
+@dataclass(frozen=True, slots=True)
+class ScenarioConfig:
+    """
+    The settings for a scenario. Each scenario creates its own instance, overriding only the defaults it changes, and passes it explicitly.
+    """
+    actorCount: int = 30
+    # stepSizeSeconds: float = 0.1
+    # simDurationSeconds: float = 120
+    stepSizeSeconds: float = 5
+    simDurationSeconds: float = 1200
+    simRadius: float = 200
+    newActorsPerTimeStep: int = 2
+    maxRange: float = 15 # m max range to bother calculating Receiver power
+    meetingMaxRange: float = 3 # m max range to consider meetings within (only used if meetings are enabled)
+    frequency: float = BLUETOOTH_FREQUENCY
+    meanSpeed: float = (3 * 1.60934 * 1000) / (60 * 60) # 3 mph into m/s ~= 1.341m/s
+    writeEverySteps: int = 50 # Readings are written out (and freed) this often, rather than all held until the end
+    maxSteps: int = field(init=False)
+    friisConstDb: float = field(init=False)
+
+    def __post_init__(self):
+        # Calculate once from this config's own settings (frozen, so set via object)
+        object.__setattr__(self, "maxSteps", int(self.simDurationSeconds / self.stepSizeSeconds))
+        object.__setattr__(self, "friisConstDb", friisConstant(self.frequency))
+
+# Default random seed, for reproducibility (each scenario creates its own generator from it, so scenarios can run in parallel)
+DEFAULT_SEED = 19680801
+
+
+class RunningSummary:
+    """
+    Keeps a running count, mean, standard deviation, minimum and maximum of a series of values, without storing the values (Welford's method).
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        """
+        Adds a single value to the summary.
+
+        Args:
+            value: float The value to add
+        """
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    @property
+    def std(self):
+        """
+        The sample standard deviation of the values added so far (as for pandas describe())
+        """
+        return math.sqrt(self._m2 / (self.count - 1)) if self.count > 1 else math.nan
+
+    def __str__(self):
+        return f"count {self.count} mean {self.mean} std {self.std} min {self.min} max {self.max}"
+
+
+def _runToFile(sim, extraActors, cfg, outputPath):
+    """
+    Runs a scenario's simulation to the end, adding each batch of new actors before its step and writing readings out as it goes.
 
-# set random seed for reproducibility
-np.random.seed(19680801)
+    Args:
+        sim: Simulation The simulation to run
+        extraActors: generator of []Actor One batch of new actors per step (See actorStream)
+        cfg: ScenarioConfig The scenario's settings
+        outputPath: str The path of the readings file to write
 
+    Returns:
+        rowCount: int The number of readings written
+    """
+    with ReadingsWriter(outputPath) as writer:
+        # extraActors yields one batch of new actors per step
+        for i, newActors in enumerate(extraActors):
+            if (i & 63) == 0:
+                logger.info("Simulation step %d, with actor count: %d", i + 1, sim.actorCount)
+            # Add extra actors
+            sim.addActors(newActors)
+            sim.step(cfg.stepSizeSeconds)
+            # Save the output data as we go
+            if (i + 1) % cfg.writeEverySteps == 0:
+                writer.write(sim.drainReadings())
+        writer.write(sim.drainReadings())
+    return writer.rowCount
 
 
 # Now specify explicit scenarios as functions
@@ -48,181 +134,164 @@ np.random.seed(19680801)
 
 
 @arguably.command
-def baselineFixedTxPower(meanPower=13):
+def baselineFixedTxPower(meanPower=13, *, seed=DEFAULT_SEED):
     """
     This function runs a simulation with each phone TxPower set to a fixed value of 13 dBm
 
     Args:
         meanPower: int Mean txpower (defaults to 13)
+        seed: int Random seed (defaults to 19680801)
     """
+    cfg = ScenarioConfig()
+    rng = np.random.default_rng(seed)
 
     # Generate our initial actors
-    actors = generateActors(actorCount, meanSpeed, txPowerMethod="fixed", meanTxPower=meanPower)
+    actors = generateActors(cfg.actorCount, cfg.meanSpeed, rng=rng, txPowerMethod="fixed", meanTxPower=meanPower)
 
-    # calculate actors to introduce each time step
-    extraActorsCount = newActorsPerTimeStep * maxSteps
-    extraActors = generateActors(extraActorsCount, meanSpeed, txPowerMethod="fixed", meanTxPower=meanPower)
+    # calculate actors to introduce each time step (generated as they are needed)
+    extraActors = actorStream(cfg.newActorsPerTimeStep, cfg.maxSteps, cfg.meanSpeed, rng=rng, txPowerMethod="fixed", meanTxPower=meanPower, firstId=cfg.actorCount + 1)
 
-    # Run the simulation for 100 seconds at 0.1 second increments (10000 steps)
-    sim = Simulation(actors, frequency, maxRange, -simRadius, simRadius,-simRadius,simRadius)
-    for i in range(maxSteps):
-        print(f"Simulation step {i + 1}, with actor count: {len(sim.actors)}")
-        # Add extra actors
-        for newActorI in range(newActorsPerTimeStep):
-            sim.addActor(extraActors[(i * newActorsPerTimeStep) + newActorI])
-        sim.step(stepSizeSeconds)
-    # Save the output data
-    data = sim.readings
-    df = pd.DataFrame(data, columns = ['time','receiverId','transmitterId','receiverPower','receiverDeviceModel','transmitterDeviceModel'])
-    print(df)
-
-    # The below takes time because of the use of float_format to make the time look sensible
     if (meanPower != 13):
-        df.to_csv(f"./output/sim-baselineFixedTxPower{meanPower}.csv", index=False) #, float_format='%.3f')
+        outputPath = f"./output/sim-baselineFixedTxPower{meanPower}.csv"
     else:
-        df.to_csv("./output/sim-baselineFixedTxPower.csv", index=False) #, float_format='%.3f')
+        outputPath = "./output/sim-baselineFixedTxPower.csv"
+
+    # Run the simulation for 100 seconds at 0.1 second increments (10000 steps)
+    sim = Simulation(actors, cfg.frequency, cfg.maxRange, -cfg.simRadius, cfg.simRadius,-cfg.simRadius,cfg.simRadius, friisConstDb = cfg.friisConstDb, rng = rng)
+    rowCount = _runToFile(sim, extraActors, cfg, outputPath)
+    print(f"Wrote {rowCount} readings to {outputPath}")
 
 
 
 @arguably.command
-def baselineGaussianTxPower():
+def baselineGaussianTxPower(*, seed=DEFAULT_SEED):
     """
     This function runs a simulation with each phone TxPower set to a gaussian selected from mean=13,sd=4
 
     Args:
+        seed: int Random seed (defaults to 19680801)
     """
     # Change any standard settings
-    simDurationSeconds = 4800
-    simDurationSteps = simDurationSeconds / stepSizeSeconds
-    maxSteps = int(simDurationSteps)
+    cfg = ScenarioConfig(simDurationSeconds = 4800)
+    rng = np.random.default_rng(seed)
 
     # Generate our initial actors
-    actors = generateActors(actorCount, meanSpeed, txPowerMethod="gaussian", meanTxPower=13)
+    actors = generateActors(cfg.actorCount, cfg.meanSpeed, rng=rng, txPowerMethod="gaussian", meanTxPower=13)
 
-    # calculate actors to introduce each time step
-    extraActorsCount = newActorsPerTimeStep * maxSteps
-    extraActors = generateActors(extraActorsCount, meanSpeed, txPowerMethod="gaussian", meanTxPower=13)
+    # calculate actors to introduce each time step (generated as they are needed)
+    extraActors = actorStream(cfg.newActorsPerTimeStep, cfg.maxSteps, cfg.meanSpeed, rng=rng, txPowerMethod="gaussian", meanTxPower=13, firstId=cfg.actorCount + 1)
 
-    # Run the simulation for 100 seconds at 0.1 second increments (10000 steps)
-    sim = Simulation(actors, frequency, maxRange, -simRadius, simRadius,-simRadius,simRadius)
-    for i in range(maxSteps):
-        print(f"Simulation step {i + 1}, with actor count: {len(sim.actors)}")
-        # Add extra actors
-        for newActorI in range(newActorsPerTimeStep):
-            sim.addActor(extraActors[(i * newActorsPerTimeStep) + newActorI])
-        sim.step(stepSizeSeconds)
-    # Save the output data
-    data = sim.readings
-    df = pd.DataFrame(data, columns = ['time','receiverId','transmitterId','receiverPower','receiverDeviceModel','transmitterDeviceModel'])
-    print(df)
+    outputPath = "./output/sim-baselineGaussianTxPower.csv"
 
-    # The below takes time because of the use of float_format to make the time look sensible
-    df.to_csv("./output/sim-baselineGaussianTxPower.csv", index=False) #, float_format='%.3f')
+    # Run the simulation for 100 seconds at 0.1 second increments (10000 steps)
+    sim = Simulation(actors, cfg.frequency, cfg.maxRange, -cfg.simRadius, cfg.simRadius,-cfg.simRadius,cfg.simRadius, friisConstDb = cfg.friisConstDb, rng = rng)
+    rowCount = _runToFile(sim, extraActors, cfg, outputPath)
+    print(f"Wrote {rowCount} readings to {outputPath}")
 
 
 
 @arguably.command
-def higherSensitivity(sensitivity=10):
+def higherSensitivity(sensitivity=10, *, seed=DEFAULT_SEED):
     """
     This function runs a simulation with each phone TxPower set to a gaussian selected from mean=13,sd=4
     but with receive sensitivity (rxGain) set higher, at 10 instead of 1.5.
 
     Args:
         sensitivity: int The fixed sensitivity to use (defaults to 10)
+        seed: int Random seed (defaults to 19680801)
     """
     # Change any standard settings
-    simDurationSeconds = 4800
-    simDurationSteps = simDurationSeconds / stepSizeSeconds
-    maxSteps = int(simDurationSteps)
+    cfg = ScenarioConfig(simDurationSeconds = 4800)
+    rng = np.random.default_rng(seed)
 
     def rxGainNamer(actorToName):
         rx = actorToName.gainRx
         actorToName.setModel(f"modelGainRx{rx:03d}")
 
     # Generate our initial actors
-    actors = generateActors(actorCount, meanSpeed, txPowerMethod="gaussian", meanTxPower=13,
+    actors = generateActors(cfg.actorCount, cfg.meanSpeed, rng=rng, txPowerMethod="gaussian", meanTxPower=13,
                             rxSensitivityMethod="fixed", meanRxSensitivity=sensitivity, namer=rxGainNamer)
 
-    # calculate actors to introduce each time step
-    extraActorsCount = newActorsPerTimeStep * maxSteps
-    extraActors = generateActors(extraActorsCount, meanSpeed, txPowerMethod="gaussian", meanTxPower=13,
+    # calculate actors to introduce each time step (generated as they are needed)
+    extraActors = actorStream(cfg.newActorsPerTimeStep, cfg.maxSteps, cfg.meanSpeed, rng=rng, txPowerMethod="gaussian", meanTxPower=13, firstId=cfg.actorCount + 1,
                             rxSensitivityMethod="fixed", meanRxSensitivity=sensitivity, namer=rxGainNamer)
 
-    # Run the simulation for 100 seconds at 0.1 second increments (10000 steps)
-    sim = Simulation(actors, frequency, maxRange, -simRadius, simRadius,-simRadius,simRadius)
-    for i in range(maxSteps):
-        print(f"Simulation step {i + 1}, with actor count: {len(sim.actors)}")
-        # Add extra actors
-        for newActorI in range(newActorsPerTimeStep):
-            sim.addActor(extraActors[(i * newActorsPerTimeStep) + newActorI])
-        sim.step(stepSizeSeconds)
-    # Save the output data
-    data = sim.readings
-    df = pd.DataFrame(data, columns = ['time','receiverId','transmitterId','receiverPower','receiverDeviceModel','transmitterDeviceModel'])
-    print(df)
-
-    # The below takes time because of the use of float_format to make the time look sensible
     if (sensitivity != 10):
-        df.to_csv(f"./output/sim-higherSensitivity{sensitivity}.csv", index=False)
+        outputPath = f"./output/sim-higherSensitivity{sensitivity}.csv"
     else:
-        df.to_csv("./output/sim-higherSensitivity.csv", index=False) #, float_format='%.3f')
+        outputPath = "./output/sim-higherSensitivity.csv"
+
+    # Run the simulation for 100 seconds at 0.1 second increments (10000 steps)
+    sim = Simulation(actors, cfg.frequency, cfg.maxRange, -cfg.simRadius, cfg.simRadius,-cfg.simRadius,cfg.simRadius, friisConstDb = cfg.friisConstDb, rng = rng)
+    rowCount = _runToFile(sim, extraActors, cfg, outputPath)
+    print(f"Wrote {rowCount} readings to {outputPath}")
 
 
 @arguably.command
-def baselineMeetings():
+def baselineMeetings(*, seed=DEFAULT_SEED):
     """
     This function runs a simulation with each phone TxPower set to a gaussian selected from mean=13,sd=4 with meeting mean duration 5 minutes, sd 1 minute, distance of 1.5m sd 0.3m.
 
     Args:
+        seed: int Random seed (defaults to 19680801)
     """
     # Change any standard settings
-    simDurationSeconds = 960 # was 960
-    stepSizeSeconds = 1 # was 0.2
-    newActorsPerTimeStep = 1
-    simDurationSteps = simDurationSeconds / stepSizeSeconds
-    maxSteps = int(simDurationSteps)
-
-    maxRange = 50 # was 15
-    meetingMaxRange = 2.3 # was 15
+    cfg = ScenarioConfig(simDurationSeconds = 960, # was 960
+                         stepSizeSeconds = 1, # was 0.2
+                         newActorsPerTimeStep = 1,
+                         maxRange = 50, # was 15
+                         meetingMaxRange = 2.3) # was 15
+    rng = np.random.default_rng(seed)
 
     # Generate our initial actors
-    actors = generateActors(actorCount, meanSpeed, txPowerMethod="gaussian", meanTxPower=13)
+    actors = generateActors(cfg.actorCount, cfg.meanSpeed, rng=rng, txPowerMethod="gaussian", meanTxPower=13)
+
+    # calculate actors to introduce each time step (generated as they are needed)
+    extraActors = actorStream(cfg.newActorsPerTimeStep, cfg.maxSteps, cfg.meanSpeed, rng=rng, txPowerMethod="gaussian", meanTxPower=13, firstId=cfg.actorCount + 1)
 
-    # calculate actors to introduce each time step
-    extraActorsCount = newActorsPerTimeStep * maxSteps
-    extraActors = generateActors(extraActorsCount, meanSpeed, txPowerMethod="gaussian", meanTxPower=13)
+    outputPath = "./output/sim-baselineMeetings.csv"
 
     # Run the simulation for 100 seconds at 0.1 second increments (10000 steps)
-    sim = Simulation(actors, frequency, maxRange, -simRadius, simRadius,-simRadius,simRadius, 
+    sim = Simulation(actors, cfg.frequency, cfg.maxRange, -cfg.simRadius, cfg.simRadius,-cfg.simRadius,cfg.simRadius, 
                      meetingDurationMean = 5*60, meetingDurationSd = 2*60, 
                      meetingDistanceMean = 1.5, meetingDistanceSd = 0.3, 
                      meetingChance = 0.9,
-                     meetingMaxRange = meetingMaxRange) 
-    for i in range(maxSteps):
-        print(f"Simulation step {i + 1}, with actor count: {len(sim.actors)}")
-        # Add extra actors
-        for newActorI in range(newActorsPerTimeStep):
-            sim.addActor(extraActors[(i * newActorsPerTimeStep) + newActorI])
-        sim.step(stepSizeSeconds)
-    # Save the output data
-    data = sim.readings
-    df = pd.DataFrame(data, columns = ['time','receiverId','transmitterId','receiverPower','receiverDeviceModel','transmitterDeviceModel'])
-    print(df)
-
-    # The below takes time because of the use of float_format to make the time look sensible
-    df.to_csv("./output/sim-baselineMeetings.csv", index=False) #, float_format='%.3f')
+                     meetingMaxRange = cfg.meetingMaxRange,
+                     friisConstDb = cfg.friisConstDb, rng = rng)
+    rowCount = _runToFile(sim, extraActors, cfg, outputPath)
+    print(f"Wrote {rowCount} readings to {outputPath}")
+    sim.flushLog("./output/sim-baselineMeetings-log.csv")
 
     # Now sanity check the meetings output of the simulation
-    meetingData = []
+    participantCounts = RunningSummary()
+    durations = RunningSummary()
     for meeting in sim.meetings:
-        meetingData.append((len(meeting.participants),meeting.start,meeting.end))
-    meetingDf = pd.DataFrame(meetingData, columns = ['participantCount','startTimeSecs','endTimeSecs'])
-    meetingDf['durationSecs'] = meetingDf['endTimeSecs'] - meetingDf['startTimeSecs']
-    summary = meetingDf.describe()
-    print(summary)
+        participantCounts.add(len(meeting.participants))
+        durations.add(meeting.end - meeting.start)
+    print(f"participantCount: {participantCounts}")
+    print(f"durationSecs: {durations}")
 
 
 
+@arguably.command
+def all_(*, seed=DEFAULT_SEED):
+    """
+    This function runs every scenario above (with its default settings) in parallel, one per process.
+
+    Args:
+        seed: int Random seed given to each scenario (defaults to 19680801)
+    """
+    scenarios = [baselineFixedTxPower, baselineGaussianTxPower, higherSensitivity, baselineMeetings]
+    # Spawn (not fork) fresh workers - forking after compiled kernels have started their thread pool can deadlock
+    with ProcessPoolExecutor(max_workers = os.cpu_count(), mp_context = multiprocessing.get_context("spawn"),
+                             initializer = configureLogging) as executor:
+        futures = [executor.submit(scenario, seed = seed) for scenario in scenarios]
+        # Wait for each in turn, so any scenario's failure is raised here
+        for future in futures:
+            future.result()
+
+
 # Expose via a main function with helper text
 if __name__ == "__main__":
+    configureLogging()
     arguably.run()
\ No newline at end of file